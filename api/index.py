@@ -1,11 +1,60 @@
 """
 Minimal Vercel serverless function for MyGPT
-Pure Python handler without heavy dependencies
+Pure Python handler; orjson is the only dependency
 """
 from http.server import BaseHTTPRequestHandler
-import json
+import re
+import uuid
+import orjson
 from datetime import datetime
-from urllib.parse import parse_qs, urlparse
+
+# Fallback responder rules, checked in order: (keywords, response).
+# A response of None means the reply is formatted at request time.
+RESPONSE_RULES = (
+    (("hi", "hello", "hey", "greetings"),
+     "Hello! I'm MyGPT, your AI assistant. How can I help you today?"),
+    (("how are you",),
+     "I'm doing well, thank you! How can I assist you?"),
+    (("your name", "who are you", "what are you"),
+     "I'm MyGPT, an AI assistant with multi-model support. I can help with coding, math, creative writing, and more!"),
+    (("what can you do", "help me", "help", "capabilities"),
+     "I can help with:\n• General conversation\n• Coding questions\n• Math and reasoning\n• Creative writing\n• Multilingual support\n\nNote: Currently in demo mode on Vercel."),
+    (("date", "time", "today", "day"),
+     None),
+    (("code", "python", "javascript", "programming"),
+     "I can help with coding! Ask me about Python, JavaScript, or any programming language."),
+    (("?",),
+     "That's an interesting question! I'm here to help. Could you provide more details?"),
+)
+
+# Every keyword compiles into a single alternation so a message is scanned once;
+# the lowest matching rule index wins, preserving the order above.
+KEYWORD_RULE = {
+    keyword: index
+    for index, (keywords, _) in enumerate(RESPONSE_RULES)
+    for keyword in keywords
+}
+# Words match on word boundaries; punctuation such as "?" matches anywhere
+KEYWORD_RE = re.compile(
+    "|".join(
+        rf"\b{re.escape(k)}\b" if k[0].isalnum() else re.escape(k)
+        for k in sorted(KEYWORD_RULE, key=len, reverse=True)
+    ),
+    re.IGNORECASE,
+)
+
+# Static response bodies, serialized once per cold start
+HEALTH_BYTES = orjson.dumps({
+    "status": "healthy",
+    "api": "MyGPT Vercel API",
+    "mode": "demo"
+})
+ROOT_BYTES = orjson.dumps({
+    "message": "MyGPT API is running",
+    "endpoints": ["/chat (POST)", "/health (GET)"],
+    "status": "online"
+})
+NOT_FOUND_BYTES = orjson.dumps({"error": "Not found"})
 
 class handler(BaseHTTPRequestHandler):
     def _set_headers(self, status=200):
@@ -21,21 +70,7 @@ class handler(BaseHTTPRequestHandler):
     
     def do_GET(self):
         self._set_headers()
-        
-        if self.path == '/health':
-            response = {
-                "status": "healthy",
-                "api": "MyGPT Vercel API",
-                "mode": "demo"
-            }
-        else:
-            response = {
-                "message": "MyGPT API is running",
-                "endpoints": ["/chat (POST)", "/health (GET)"],
-                "status": "online"
-            }
-        
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(HEALTH_BYTES if self.path == '/health' else ROOT_BYTES)
     
     def do_POST(self):
         if self.path == '/chat':
@@ -43,7 +78,7 @@ class handler(BaseHTTPRequestHandler):
             post_data = self.rfile.read(content_length)
             
             try:
-                data = json.loads(post_data.decode())
+                data = orjson.loads(post_data)
                 message = data.get('message', '')
                 
                 # Generate response
@@ -51,47 +86,32 @@ class handler(BaseHTTPRequestHandler):
                 
                 response = {
                     "response": response_text,
-                    "conversation_id": f"guest_{datetime.utcnow().timestamp()}",
+                    "conversation_id": f"guest_{uuid.uuid4().hex}",
                     "is_guest": True,
                     "model_used": "fallback",
                     "task_type": "general"
                 }
                 
                 self._set_headers(200)
-                self.wfile.write(json.dumps(response).encode())
+                self.wfile.write(orjson.dumps(response))
             except Exception as e:
                 self._set_headers(500)
                 error_response = {"error": str(e)}
-                self.wfile.write(json.dumps(error_response).encode())
+                self.wfile.write(orjson.dumps(error_response))
         else:
             self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not found"}).encode())
+            self.wfile.write(NOT_FOUND_BYTES)
     
     def get_simple_response(self, message: str) -> str:
         """Enhanced fallback responses"""
-        message_lower = message.lower()
-        
-        if any(g in message_lower for g in ["hi", "hello", "hey", "greetings"]):
-            return "Hello! I'm MyGPT, your AI assistant. How can I help you today?"
-        
-        if "how are you" in message_lower:
-            return "I'm doing well, thank you! How can I assist you?"
-        
-        if any(q in message_lower for q in ["your name", "who are you", "what are you"]):
-            return "I'm MyGPT, an AI assistant with multi-model support. I can help with coding, math, creative writing, and more!"
-        
-        if any(q in message_lower for q in ["what can you do", "help me", "help", "capabilities"]):
-            return "I can help with:\n• General conversation\n• Coding questions\n• Math and reasoning\n• Creative writing\n• Multilingual support\n\nNote: Currently in demo mode on Vercel."
-        
-        if any(q in message_lower for q in ["date", "time", "today", "day"]):
-            now = datetime.now()
-            return f"Today is {now.strftime('%A, %B %d, %Y')}. The current time is {now.strftime('%I:%M %p')}."
-        
-        if any(q in message_lower for q in ["code", "python", "javascript", "programming"]):
-            return "I can help with coding! Ask me about Python, JavaScript, or any programming language."
+        hits = {KEYWORD_RULE[m.lower()] for m in KEYWORD_RE.findall(message)}
         
-        if "?" in message:
-            return "That's an interesting question! I'm here to help. Could you provide more details?"
+        if hits:
+            response = RESPONSE_RULES[min(hits)][1]
+            if response is None:
+                now = datetime.now()
+                return f"Today is {now.strftime('%A, %B %d, %Y')}. The current time is {now.strftime('%I:%M %p')}."
+            return response
         
         return "I understand. How can I assist you further?"
 
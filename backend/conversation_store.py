@@ -0,0 +1,186 @@
+"""
+Conversation storage for the backend
+Persists conversations in Upstash Redis when configured so that every
+serverless instance sees the same history, with an in-process fallback
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    """
+    Conversation store keyed by conversation id
+
+    With Upstash Redis configured (HTTP based, so it works from Vercel and
+    other serverless runtimes) Redis is the source of truth and reads go to it,
+    keeping replicas consistent. Without it, conversations live in process.
+    The in-process copy is an LRU capped at max_local entries so a long-lived
+    warm instance cannot grow without bound, and a per-user index of its ids
+    keeps listings proportional to the user's own conversations.
+
+    put_nowait() updates the local copy immediately and writes to Redis in a
+    background task, so the Redis round trip stays off the response path;
+    reads on the same instance see their own pending writes.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        redis_token: Optional[str] = None,
+        max_local: int = 1024
+    ):
+        self._local: "OrderedDict[str, Dict]" = OrderedDict()
+        self._max_local = max_local
+        self._user_index: Dict[str, Set[str]] = {}
+        self._redis = None
+
+        # Background writes: latest scheduled version and a write lock per conversation
+        self._versions = itertools.count()
+        self._pending: Dict[str, int] = {}
+        self._write_locks: Dict[str, asyncio.Lock] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        if redis_url and redis_token:
+            from upstash_redis.asyncio import Redis
+            self._redis = Redis(url=redis_url, token=redis_token)
+
+    @classmethod
+    def from_env(cls) -> "ConversationStore":
+        """Create a store from UPSTASH_REDIS_REST_URL / UPSTASH_REDIS_REST_TOKEN"""
+        return cls(os.getenv("UPSTASH_REDIS_REST_URL"), os.getenv("UPSTASH_REDIS_REST_TOKEN"))
+
+    def _remember(self, conv_id: str, conversation: Dict) -> None:
+        """
+        Insert into the in-process LRU as most recently used, evicting the oldest
+        Conversations with a pending Redis write are kept: until it lands, the
+        local copy is the only up-to-date one
+        """
+        self._local[conv_id] = conversation
+        self._local.move_to_end(conv_id)
+        self._user_index.setdefault(conversation["user_email"], set()).add(conv_id)
+
+        while len(self._local) > self._max_local:
+            evicted_id = next(
+                (cid for cid in self._local if cid != conv_id and cid not in self._pending), None
+            )
+            if evicted_id is None:
+                break
+            evicted = self._local.pop(evicted_id)
+            self._forget_owner(evicted_id, evicted["user_email"])
+
+    def _forget_owner(self, conv_id: str, user_email: str) -> None:
+        """Drop conv_id from the per-user index"""
+        owned = self._user_index.get(user_email)
+        if owned is not None:
+            owned.discard(conv_id)
+            if not owned:
+                del self._user_index[user_email]
+
+    @staticmethod
+    def _conv_key(conv_id: str) -> str:
+        return f"conv:{conv_id}"
+
+    @staticmethod
+    def _user_key(user_email: str) -> str:
+        return f"user_convs:{user_email}"
+
+    async def get(self, conv_id: str) -> Optional[Dict]:
+        """Get a conversation by id, or None if it does not exist"""
+        if self._redis is not None and conv_id not in self._pending:
+            raw = await self._redis.get(self._conv_key(conv_id))
+            if raw is None:
+                # Redis is authoritative: drop a copy deleted on another instance
+                stale = self._local.pop(conv_id, None)
+                if stale is not None:
+                    self._forget_owner(conv_id, stale["user_email"])
+                return None
+
+            conversation = orjson.loads(raw)
+            self._remember(conv_id, conversation)
+            return conversation
+
+        conversation = self._local.get(conv_id)
+        if conversation is not None:
+            self._local.move_to_end(conv_id)
+        return conversation
+
+    def put_nowait(self, conv_id: str, conversation: Dict) -> None:
+        """Create or replace a conversation, persisting to Redis in the background"""
+        self._remember(conv_id, conversation)
+
+        if self._redis is None:
+            return
+
+        # Snapshot now: the caller may keep mutating the conversation
+        payload = orjson.dumps(conversation).decode()
+        version = next(self._versions)
+        self._pending[conv_id] = version
+
+        task = asyncio.create_task(
+            self._persist(conv_id, conversation["user_email"], payload, version)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _persist(self, conv_id: str, user_email: str, payload: str, version: int) -> None:
+        """Write a snapshot unless a newer one for the same conversation is queued"""
+        lock = self._write_locks.setdefault(conv_id, asyncio.Lock())
+        try:
+            async with lock:
+                if self._pending.get(conv_id) != version:
+                    return
+                await self._redis.set(self._conv_key(conv_id), payload)
+                await self._redis.sadd(self._user_key(user_email), conv_id)
+        except Exception:
+            logger.exception("Failed to persist conversation %s", conv_id)
+        finally:
+            if self._pending.get(conv_id) == version:
+                del self._pending[conv_id]
+                self._write_locks.pop(conv_id, None)
+
+    async def flush(self) -> None:
+        """Wait for all background writes to finish"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def delete(self, conv_id: str, user_email: str) -> None:
+        """Delete a conversation owned by user_email"""
+        self._local.pop(conv_id, None)
+        self._forget_owner(conv_id, user_email)
+
+        if self._redis is not None:
+            # Drop queued writes and wait out one already in flight
+            self._pending.pop(conv_id, None)
+            lock = self._write_locks.pop(conv_id, None)
+            if lock is not None:
+                async with lock:
+                    pass
+            await self._redis.delete(self._conv_key(conv_id))
+            await self._redis.srem(self._user_key(user_email), conv_id)
+
+    async def list_for_user(self, user_email: str) -> List[Dict]:
+        """Get all conversations owned by user_email"""
+        if self._redis is None:
+            return [self._local[conv_id] for conv_id in self._user_index.get(user_email, ())]
+
+        conv_ids = list(await self._redis.smembers(self._user_key(user_email)))
+        if not conv_ids:
+            return []
+
+        raws = await self._redis.mget(*[self._conv_key(conv_id) for conv_id in conv_ids])
+        conversations = []
+        for conv_id, raw in zip(conv_ids, raws):
+            if raw is not None:
+                conversation = orjson.loads(raw)
+                self._remember(conv_id, conversation)
+                conversations.append(conversation)
+        return conversations
@@ -1,16 +1,30 @@
 import os
+import re
 import json
-from datetime import datetime, timedelta
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from datetime import datetime
 from typing import Optional, List
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+import msgspec
+import orjson
 from fastapi.middleware.cors import CORSMiddleware
-import jwt
-from passlib.context import CryptContext
-import requests
+from conversation_store import ConversationStore
 
-app = FastAPI(title="ChatGPT Clone API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Shutdown: finish background conversation writes, then close the shared HF client
+    await conversation_store.flush()
+    if _hf_client is not None:
+        await _hf_client.aclose()
+
+app = FastAPI(title="ChatGPT Clone API", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -25,10 +39,17 @@ app.add_middleware(
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # Lower (e.g. 10) for faster dev logins
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+# jwt, passlib/bcrypt and httpx are imported where they are used so that
+# guest chat in fallback mode does not pay for them on a cold start
+@lru_cache(maxsize=1)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
 # --- HUGGING FACE API CONFIGURATION ---
 HF_API_KEY = os.getenv("HF_API_KEY", "")
 
@@ -36,54 +57,68 @@ HF_API_KEY = os.getenv("HF_API_KEY", "")
 USE_SERVERLESS = False  # Disabled - models return 410
 SERVERLESS_MODEL = "microsoft/DialoGPT-medium"
 HF_ROUTER_URL = "https://router.huggingface.co/v1/chat/completions"
+HF_ROUTER_MODEL = "meta-llama/Llama-3.2-3B-Instruct"
 USE_SIMPLE_FALLBACK = True  # Always use fallback for now
 
-print("=" * 50)
-print("ChatGPT Clone API - Fallback Mode")
-print("⚠️ HF Inference API models deprecated (410)")
-print("✓ Using enhanced fallback responses")
-print("✓ To use real AI: Deploy to Hugging Face Spaces")
-print("=" * 50)
+# Startup banner is opt-in so serverless cold starts skip the log I/O
+if os.getenv("MYGPT_BANNER") == "1":
+    print("=" * 50)
+    print("ChatGPT Clone API - Fallback Mode")
+    print("⚠️ HF Inference API models deprecated (410)")
+    print("✓ Using enhanced fallback responses")
+    print("✓ To use real AI: Deploy to Hugging Face Spaces")
+    print("=" * 50)
 
 # Simple in-memory storage (replace with real database in production)
 users_db = {}
-conversations_db = {}
+conversation_store = ConversationStore.from_env()
 
-# Models
-class UserRegister(BaseModel):
+# Models (msgspec structs: decoded and validated in one C pass)
+class UserRegister(msgspec.Struct):
     email: str
     password: str
     name: str
 
-class UserLogin(BaseModel):
+class UserLogin(msgspec.Struct):
     email: str
     password: str
 
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct):
     message: str
     conversation_id: Optional[str] = None
     model_preference: Optional[str] = None  # Allow users to specify preferred model
+    stream: bool = False  # Stream the reply as server-sent events (HF Router mode only)
 
-class Message(BaseModel):
+class Message(msgspec.Struct):
     role: str
     content: str
     timestamp: str
 
-class Conversation(BaseModel):
+class Conversation(msgspec.Struct):
     id: str
     title: str
     messages: List[Message]
     created_at: str
     updated_at: str
 
+def body_parser(model):
+    """Build a dependency that decodes the raw request body into a msgspec struct"""
+    async def parse(request: Request):
+        try:
+            return msgspec.json.decode(await request.body(), type=model)
+        except msgspec.DecodeError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return parse
+
 # Auth functions
 def create_access_token(data: dict):
+    import jwt
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode["exp"] = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    import jwt
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -98,11 +133,12 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
 
 # Auth endpoints
 @app.post("/auth/register")
-async def register(user: UserRegister):
+async def register(user: UserRegister = Depends(body_parser(UserRegister))):
     if user.email in users_db:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = pwd_context.hash(user.password)
+    # bcrypt is CPU-bound; hash off the event loop so other requests keep flowing
+    hashed_password = await run_in_threadpool(get_pwd_context().hash, user.password)
     users_db[user.email] = {
         "email": user.email,
         "name": user.name,
@@ -114,12 +150,12 @@ async def register(user: UserRegister):
     return {"token": token, "user": {"email": user.email, "name": user.name}}
 
 @app.post("/auth/login")
-async def login(user: UserLogin):
+async def login(user: UserLogin = Depends(body_parser(UserLogin))):
     if user.email not in users_db:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     stored_user = users_db[user.email]
-    if not pwd_context.verify(user.password, stored_user["password"]):
+    if not await run_in_threadpool(get_pwd_context().verify, user.password, stored_user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_access_token({"sub": user.email})
@@ -136,6 +172,7 @@ async def get_current_user(email: str = Depends(verify_token)):
 async def optional_verify_token(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False))):
     if credentials is None:
         return None  # Guest user
+    import jwt
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -145,50 +182,118 @@ async def optional_verify_token(credentials: HTTPAuthorizationCredentials = Depe
         return None  # Invalid token, treat as guest
 
 # Enhanced fallback responses when API fails
-def get_simple_response(message: str) -> str:
-    """Enhanced rule-based responses as fallback"""
-    message_lower = message.lower()
-    
+# Rules are checked in order: (keywords, response); None is formatted per request
+RESPONSE_RULES = (
     # Greetings
-    greetings = ["hi", "hello", "hey", "greetings", "good morning", "good afternoon"]
-    if any(g in message_lower for g in greetings):
-        return "Hello! I'm MyGPT, your AI assistant. I'm currently running in fallback mode because Hugging Face Inference API models are deprecated. How can I help you today?"
-    
+    (("hi", "hello", "hey", "greetings", "good morning", "good afternoon"),
+     "Hello! I'm MyGPT, your AI assistant. I'm currently running in fallback mode because Hugging Face Inference API models are deprecated. How can I help you today?"),
     # How are you
-    if "how are you" in message_lower:
-        return "I'm doing well, thank you! I'm running in fallback mode right now. For full AI capabilities, this app needs to be deployed to Hugging Face Spaces or use a different API provider."
-    
+    (("how are you",),
+     "I'm doing well, thank you! I'm running in fallback mode right now. For full AI capabilities, this app needs to be deployed to Hugging Face Spaces or use a different API provider."),
     # Identity questions
-    if any(q in message_lower for q in ["your name", "who are you", "what are you"]):
-        return "I'm MyGPT, an AI assistant with multi-model support. Currently in fallback mode due to API limitations. I can help with basic questions!"
-    
+    (("your name", "who are you", "what are you"),
+     "I'm MyGPT, an AI assistant with multi-model support. Currently in fallback mode due to API limitations. I can help with basic questions!"),
     # Capabilities
-    if any(q in message_lower for q in ["what can you do", "help me", "help", "capabilities"]):
-        return "I'm designed to help with:\n• General conversation\n• Coding questions (9 specialized models)\n• Math and reasoning\n• Creative writing\n• Multilingual support\n\nNote: Full AI features require deployment to Hugging Face Spaces or a working API endpoint."
-    
+    (("what can you do", "help me", "help", "capabilities"),
+     "I'm designed to help with:\n• General conversation\n• Coding questions (9 specialized models)\n• Math and reasoning\n• Creative writing\n• Multilingual support\n\nNote: Full AI features require deployment to Hugging Face Spaces or a working API endpoint."),
     # Date/Time
-    if any(q in message_lower for q in ["date", "time", "today", "day"]):
-        from datetime import datetime
-        now = datetime.now()
-        return f"Today is {now.strftime('%A, %B %d, %Y')}. The current time is {now.strftime('%I:%M %p')}."
-    
+    (("date", "time", "today", "day"),
+     None),
     # Coding questions
-    if any(q in message_lower for q in ["code", "python", "javascript", "programming", "function"]):
-        return "I can help with coding! However, I'm in fallback mode right now. For full coding assistance with specialized models (Qwen Coder, DeepSeek), please deploy this app to Hugging Face Spaces."
-    
+    (("code", "python", "javascript", "programming", "function"),
+     "I can help with coding! However, I'm in fallback mode right now. For full coding assistance with specialized models (Qwen Coder, DeepSeek), please deploy this app to Hugging Face Spaces."),
     # Math questions
-    if any(q in message_lower for q in ["calculate", "math", "solve", "equation"]):
-        return "I can help with math! In fallback mode, I have limited capabilities. For advanced math reasoning with DeepSeek R1 or Qwen Math models, deploy to Hugging Face Spaces."
-    
+    (("calculate", "math", "solve", "equation"),
+     "I can help with math! In fallback mode, I have limited capabilities. For advanced math reasoning with DeepSeek R1 or Qwen Math models, deploy to Hugging Face Spaces."),
     # Questions
-    if "?" in message:
-        return "That's an interesting question! I'm currently in fallback mode with limited AI capabilities. For intelligent responses powered by 9 specialized models, this app needs to be deployed to Hugging Face Spaces where the Inference API works properly."
+    (("?",),
+     "That's an interesting question! I'm currently in fallback mode with limited AI capabilities. For intelligent responses powered by 9 specialized models, this app needs to be deployed to Hugging Face Spaces where the Inference API works properly."),
+)
+
+# All keywords compile into one alternation so each message is scanned once;
+# the lowest matching rule index wins
+KEYWORD_RULE = {
+    keyword: index
+    for index, (keywords, _) in enumerate(RESPONSE_RULES)
+    for keyword in keywords
+}
+# Words match on word boundaries; punctuation such as "?" matches anywhere
+KEYWORD_RE = re.compile(
+    "|".join(
+        rf"\b{re.escape(k)}\b" if k[0].isalnum() else re.escape(k)
+        for k in sorted(KEYWORD_RULE, key=len, reverse=True)
+    ),
+    re.IGNORECASE,
+)
+
+def get_simple_response(message: str) -> str:
+    """Enhanced rule-based responses as fallback"""
+    hits = {KEYWORD_RULE[m.lower()] for m in KEYWORD_RE.findall(message)}
+    
+    if hits:
+        response = RESPONSE_RULES[min(hits)][1]
+        if response is None:
+            now = datetime.now()
+            return f"Today is {now.strftime('%A, %B %d, %Y')}. The current time is {now.strftime('%I:%M %p')}."
+        return response
     
     # Default
     return "I understand. I'm running in fallback mode right now. For full AI-powered conversations, please deploy this app to Hugging Face Spaces or configure a working API endpoint."
 
+# Shared Hugging Face client: keeps TCP/TLS connections alive between requests.
+# Created on first use so fallback mode never imports httpx
+_hf_client = None
+
+def get_hf_client():
+    global _hf_client
+    if _hf_client is None:
+        import httpx
+        _hf_client = httpx.AsyncClient(
+            timeout=60,
+            http2=True,
+            headers={"Authorization": f"Bearer {HF_API_KEY}"}
+        )
+    return _hf_client
+
+def router_payload(messages: List[dict], stream: bool = False) -> dict:
+    """Build an HF Router chat completion payload from the last 5 exchanges"""
+    return {
+        "model": HF_ROUTER_MODEL,
+        "messages": [
+            {"role": msg.get("role", "user"), "content": msg.get("content", "")}
+            for msg in messages[-10:]
+        ],
+        "max_tokens": 500,
+        "temperature": 0.7,
+        "stream": stream
+    }
+
+async def stream_router_response(messages: List[dict]):
+    """
+    Yield content deltas from the HF Router as they are generated
+    Raises httpx.HTTPStatusError on a non-200 response, and ValueError on a malformed frame
+    """
+    client = get_hf_client()
+    async with client.stream("POST", HF_ROUTER_URL, json=router_payload(messages, stream=True), timeout=30) as response:
+        response.raise_for_status()
+        
+        async for line in response.aiter_lines():
+            # SSE frames look like "data: {...}"; the stream ends with "data: [DONE]"
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                break
+            # Frames without text, or of an unexpected shape, are skipped
+            try:
+                delta = orjson.loads(data)["choices"][0]["delta"]["content"]
+            except (LookupError, TypeError):
+                continue
+            if delta and isinstance(delta, str):
+                yield delta
+
 # Helper function for Serverless or Router API
-def generate_response(messages: List[dict], model_preference: Optional[str] = None) -> dict:
+async def generate_response(messages: List[dict], model_preference: Optional[str] = None) -> dict:
     """
     Generate AI response using Serverless Inference API or HF Router
     """
@@ -203,13 +308,11 @@ def generate_response(messages: List[dict], model_preference: Optional[str] = No
                 "status": "success"
             }
         
+        client = get_hf_client()
+        
         if USE_SERVERLESS:
             # Use Serverless Inference API - works with basic tokens
             url = f"https://api-inference.huggingface.co/models/{SERVERLESS_MODEL}"
-            headers = {
-                "Authorization": f"Bearer {HF_API_KEY}",
-                "Content-Type": "application/json"
-            }
             
             # Build conversation text
             conversation_text = ""
@@ -230,7 +333,7 @@ def generate_response(messages: List[dict], model_preference: Optional[str] = No
                 }
             }
             
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
+            response = await client.post(url, json=payload, timeout=60)
             
             if response.status_code == 200:
                 result = response.json()
@@ -319,26 +422,8 @@ def generate_response(messages: List[dict], model_preference: Optional[str] = No
         
         else:
             # Use HF Router (requires special token permissions)
-            headers = {
-                "Authorization": f"Bearer {HF_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            formatted_messages = []
-            for msg in messages[-10:]:
-                formatted_messages.append({
-                    "role": msg.get("role", "user"),
-                    "content": msg.get("content", "")
-                })
-            
-            payload = {
-                "model": "meta-llama/Llama-3.2-3B-Instruct",
-                "messages": formatted_messages,
-                "max_tokens": 500,
-                "temperature": 0.7
-            }
-            
-            response = requests.post(HF_ROUTER_URL, headers=headers, json=payload, timeout=30)
+            payload = router_payload(messages)
+            response = await client.post(HF_ROUTER_URL, json=payload, timeout=30)
             
             if response.status_code == 200:
                 result = response.json()
@@ -372,37 +457,86 @@ def generate_response(messages: List[dict], model_preference: Optional[str] = No
 
 # Chat endpoints
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest, email: Optional[str] = Depends(optional_verify_token)):
+async def chat_endpoint(request: ChatRequest = Depends(body_parser(ChatRequest)), email: Optional[str] = Depends(optional_verify_token)):
     # For guest users, use temporary ID
     user_id = email if email else "guest"
     
+    # Read the clock once per request
+    now = datetime.utcnow()
+    now_iso = now.isoformat()
+    
     # Get or create conversation
-    conv_id = request.conversation_id or f"{user_id}_{datetime.utcnow().timestamp()}"
+    conv_id = request.conversation_id or f"{user_id}_{uuid.uuid4().hex}"
     
-    if conv_id not in conversations_db:
-        conversations_db[conv_id] = {
+    conversation = await conversation_store.get(conv_id)
+    if conversation is None:
+        conversation = {
             "id": conv_id,
             "user_email": user_id,
             "title": request.message[:50],
             "messages": [],
-            "created_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat(),
+            "created_at": now_iso,
+            "updated_at": now_iso,
             "is_guest": email is None
         }
     
-    conversation = conversations_db[conv_id]
-    
     # Add user message
     user_msg = {
         "role": "user",
         "content": request.message,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": now_iso
     }
     conversation["messages"].append(user_msg)
     
+    if request.stream and not USE_SIMPLE_FALLBACK and not USE_SERVERLESS:
+        async def event_stream():
+            import httpx
+            
+            parts = []
+            error = None
+            try:
+                async for delta in stream_router_response(conversation["messages"]):
+                    parts.append(delta)
+                    yield b"data: " + orjson.dumps({"delta": delta}) + b"\n\n"
+            except httpx.HTTPStatusError as e:
+                error = f"⚠️ Error {e.response.status_code}. Router requires special API token permissions."
+            except (httpx.HTTPError, ValueError) as e:
+                error = f"❌ Technical error: {str(e)}"
+            finally:
+                # Persist the reply even if the stream failed or the client went
+                # away; a failed reply is marked as an error like generate_response does
+                if error is None:
+                    model_used, task_type = "HF Router", "general"
+                    content = "".join(parts).strip()
+                else:
+                    model_used, task_type = "error", "error"
+                    content = error
+                conversation["messages"].append({
+                    "role": "assistant",
+                    "content": content,
+                    "timestamp": now_iso,
+                    "model_used": model_used,
+                    "task_type": task_type
+                })
+                conversation["updated_at"] = now_iso
+                conversation_store.put_nowait(conv_id, conversation)
+            
+            if error is not None:
+                yield b"data: " + orjson.dumps({"error": error}) + b"\n\n"
+            
+            yield b"data: " + orjson.dumps({
+                "done": True,
+                "conversation_id": conv_id,
+                "is_guest": email is None,
+                "model_used": model_used,
+                "task_type": task_type
+            }) + b"\n\n"
+        
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+    
     try:
         # Generate response using multi-model router
-        result = generate_response(conversation["messages"], request.model_preference)
+        result = await generate_response(conversation["messages"], request.model_preference)
         
         response_text = result.get("content", "Error generating response")
         model_used = result.get("model_used", "unknown")
@@ -412,12 +546,13 @@ async def chat_endpoint(request: ChatRequest, email: Optional[str] = Depends(opt
         assistant_msg = {
             "role": "assistant",
             "content": response_text,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": now_iso,
             "model_used": model_used,
             "task_type": task_type
         }
         conversation["messages"].append(assistant_msg)
-        conversation["updated_at"] = datetime.utcnow().isoformat()
+        conversation["updated_at"] = now_iso
+        conversation_store.put_nowait(conv_id, conversation)
         
         return {
             "response": response_text,
@@ -439,32 +574,33 @@ async def get_conversations(email: str = Depends(verify_token)):
             "updated_at": conv["updated_at"],
             "message_count": len(conv["messages"])
         }
-        for conv in conversations_db.values()
-        if conv["user_email"] == email
+        for conv in await conversation_store.list_for_user(email)
     ]
-    return sorted(user_conversations, key=lambda x: x["updated_at"], reverse=True)
+    user_conversations.sort(key=lambda x: x["updated_at"], reverse=True)
+    # Returning the response directly skips FastAPI's jsonable_encoder walk
+    return ORJSONResponse(user_conversations)
 
 @app.get("/conversations/{conversation_id}")
 async def get_conversation(conversation_id: str, email: str = Depends(verify_token)):
-    if conversation_id not in conversations_db:
+    conversation = await conversation_store.get(conversation_id)
+    if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    conversation = conversations_db[conversation_id]
     if conversation["user_email"] != email:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return conversation
+    return ORJSONResponse(conversation)
 
 @app.delete("/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str, email: str = Depends(verify_token)):
-    if conversation_id not in conversations_db:
+    conversation = await conversation_store.get(conversation_id)
+    if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    conversation = conversations_db[conversation_id]
     if conversation["user_email"] != email:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    del conversations_db[conversation_id]
+    await conversation_store.delete(conversation_id, email)
     return {"message": "Conversation deleted"}
 
 @app.get("/health")
@@ -483,19 +619,18 @@ async def health_check():
             "requires": "inference API token permissions"
         }
 
+# The model list only depends on module configuration, so build it once
+if USE_SIMPLE_FALLBACK:
+    _MODELS_RESP = {"mode": "fallback", "models": []}
+elif USE_SERVERLESS:
+    _MODELS_RESP = {"mode": "serverless", "models": [SERVERLESS_MODEL]}
+else:
+    _MODELS_RESP = {"mode": "router", "models": [HF_ROUTER_MODEL]}
+
 @app.get("/models")
 async def list_models():
     """Get list of all available models and their capabilities"""
-    if USE_HF_ROUTER:
-        return {
-            "mode": "router",
-            "message": "Using HF Router for automatic model selection"
-        }
-    else:
-        return {
-            "models": model_router.list_available_models(),
-            "task_types": [t.value for t in TaskType]
-        }
+    return _MODELS_RESP
 
 if __name__ == "__main__":
     import uvicorn
@@ -4,10 +4,25 @@ Routes requests to the best model based on task type and requirements
 """
 
 import os
+import re
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from itertools import islice
+import httpx
+import orjson
+from cachetools import TTLCache
 import requests
-from typing import List, Dict, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Sequence, Tuple
 from enum import Enum
 
+logger = logging.getLogger(__name__)
+
 class TaskType(Enum):
     """Task categories for model routing"""
     GENERAL_CHAT = "general_chat"
@@ -19,6 +34,59 @@ class TaskType(Enum):
     VISION = "vision"
     FAST_RESPONSE = "fast_response"
 
+# Task detection keywords, compiled once into a single regex with one named
+# group per category so a message is scanned in one pass.
+# Keywords must start a word (so "api" no longer matches inside "rapid") but
+# may carry a suffix, so plurals and inflections ("functions", "poems") still
+# count; an explicit lookbehind instead of \b so that "c++" still matches.
+CODE_KEYWORDS = ("code", "function", "class", "debug", "error", "python", "javascript",
+                 "java", "c++", "programming", "algorithm", "api", "sql", "html", "css")
+MATH_KEYWORDS = ("calculate", "solve", "equation", "math", "proof", "logic",
+                 "reasoning", "analyze", "theorem", "formula")
+CREATIVE_KEYWORDS = ("write", "story", "poem", "creative", "imagine", "describe",
+                     "narrative", "character", "plot")
+
+# Categories in priority order: the first one with a hit wins
+KEYWORD_TASKS = (
+    (TaskType.CODING, CODE_KEYWORDS),
+    (TaskType.REASONING, MATH_KEYWORDS),
+    (TaskType.CREATIVE, CREATIVE_KEYWORDS),
+)
+
+_TASK_RE = re.compile(
+    r"(?<!\w)(?:"
+    + "|".join(
+        f"(?P<{task.value}>{'|'.join(re.escape(k) for k in keywords)})"
+        for task, keywords in KEYWORD_TASKS
+    )
+    + r")\w*",
+    re.IGNORECASE
+)
+
+def _recent(messages: Sequence[Dict], n: int) -> List[Dict]:
+    """Last n messages as a list; accepts a list or a bounded deque of history"""
+    if isinstance(messages, list):
+        return messages[-n:]
+    return list(islice(messages, max(0, len(messages) - n), None))
+
+# Responses are only cached at (near) deterministic temperatures
+CACHE_MAX_TEMPERATURE = 0.1
+
+# User-facing messages for known API error statuses
+ERROR_MESSAGES = {
+    503: "⏳ Model is loading (first request takes ~20 seconds). Please try again!",
+    401: "🔑 API authentication failed. Please check your Hugging Face token.",
+    403: "🔑 API authentication failed. Please check your Hugging Face token.",
+    429: "⏸️ Rate limit reached. Please wait a moment and try again.",
+    410: "⚠️ Model endpoint is no longer available. Trying fallback model..."
+}
+
+# Async requests fall through up to MAX_CANDIDATES models in priority order:
+# the next one starts only when the latest fails or has not answered within
+# HEDGE_DELAY seconds, so a healthy primary keeps its traffic
+MAX_CANDIDATES = 3
+HEDGE_DELAY = 10.0
+
 class ModelRouter:
     """
     Intelligent model router that selects the best Hugging Face model
@@ -29,6 +97,46 @@ class ModelRouter:
         self.hf_api_key = hf_api_key
         self.base_url = "https://api-inference.huggingface.co/models"
         
+        # Pooled session: reuses TCP/TLS connections across calls
+        self._headers = {
+            "Authorization": f"Bearer {hf_api_key}",
+            "Content-Type": "application/json"
+        }
+        self.session = requests.Session()
+        # Transient connection failures and gateway/cold-start statuses are
+        # retried with backoff; POST has to be allowed explicitly. Once retries
+        # are exhausted the last response is returned so _handle_error sees it.
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(["POST"]),
+                raise_on_status=False
+            )
+        ))
+        
+        # Async client for event-loop callers: one multiplexed HTTP/2 connection,
+        # retrying failed connection attempts
+        self._client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+            ),
+            timeout=30.0,
+            headers=self._headers
+        )
+        
+        # Identical concurrent async requests share one in-flight call
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+        
+        # Short-lived cache of successful deterministic responses (repeats, retries)
+        self._response_cache: TTLCache = TTLCache(maxsize=256, ttl=300)
+        self._cache_lock = threading.Lock()
+        
         # Model registry with capabilities and endpoints
         # Using WORKING models that are available on HF Inference API
         self.models = {
@@ -101,33 +209,59 @@ class ModelRouter:
         
         # Default fallback model - most reliable
         self.default_model = "llama-3.2-3b"
+        
+        # Candidates per task type, sorted once by priority (lower is better)
+        self._by_task: Dict[TaskType, List[Tuple[str, Dict]]] = {
+            task: sorted(
+                [(key, config) for key, config in self.models.items() if task in config["tasks"]],
+                key=lambda x: x[1]["priority"]
+            )
+            for task in TaskType
+        }
+        
+        # Request builder and response parser per API format
+        self._formats = {
+            "chat": (self._chat_request, self._parse_chat_result),
+            "standard": (self._standard_request, self._parse_standard_result)
+        }
+        
+        # Endpoint URLs per model id, formatted once
+        self._chat_urls = {
+            c["id"]: f"{self.base_url}/{c['id']}/v1/chat/completions" for c in self.models.values()
+        }
+        self._standard_urls = {c["id"]: f"{self.base_url}/{c['id']}" for c in self.models.values()}
+        
+        # Enum-to-string conversions done once instead of per response
+        self._task_values: Dict[Optional[TaskType], str] = {t: t.value for t in TaskType}
+        self._models_summary: List[Dict] = [
+            {
+                "key": key,
+                "id": config["id"],
+                "tasks": [self._task_values[t] for t in config["tasks"]],
+                "priority": config["priority"]
+            }
+            for key, config in self.models.items()
+        ]
     
     def detect_task_type(self, message: str, conversation_history: List[Dict]) -> TaskType:
         """
         Analyze message content to determine the best task type
         """
-        message_lower = message.lower()
-        
-        # Coding detection
-        code_keywords = ["code", "function", "class", "debug", "error", "python", "javascript", 
-                        "java", "c++", "programming", "algorithm", "api", "sql", "html", "css"]
-        if any(keyword in message_lower for keyword in code_keywords):
-            return TaskType.CODING
-        
-        # Math/Reasoning detection
-        math_keywords = ["calculate", "solve", "equation", "math", "proof", "logic", 
-                        "reasoning", "analyze", "theorem", "formula"]
-        if any(keyword in message_lower for keyword in math_keywords):
-            return TaskType.REASONING
-        
-        # Creative writing detection
-        creative_keywords = ["write", "story", "poem", "creative", "imagine", "describe",
-                           "narrative", "character", "plot"]
-        if any(keyword in message_lower for keyword in creative_keywords):
-            return TaskType.CREATIVE
+        return self._classify(message)
+    
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _classify(message: str) -> TaskType:
+        """Pure classifier behind detect_task_type, cached for repeated messages (retries)"""
+        # Keyword detection (coding, then math/reasoning, then creative writing)
+        hits = {match.lastgroup for match in _TASK_RE.finditer(message)}
+        if hits:
+            for task, _ in KEYWORD_TASKS:
+                if task.value in hits:
+                    return task
         
         # Multilingual detection (non-English characters)
-        if any(ord(char) > 127 for char in message):
+        if not message.isascii():
             return TaskType.MULTILINGUAL
         
         # Fast response for short queries
@@ -141,20 +275,42 @@ class ModelRouter:
         Select the best model for the given task type
         Returns: (model_key, model_config)
         """
-        # Find models that support this task
-        candidates = [
-            (key, config) for key, config in self.models.items()
-            if task_type in config["tasks"]
-        ]
+        candidates = self._by_task.get(task_type)
+        if candidates:
+            return candidates[0]
         
-        if not candidates and fallback:
-            # Use default model as fallback
-            return self.default_model, self.models[self.default_model]
+        # Use default model as fallback
+        return self.default_model, self.models[self.default_model]
+    
+    def _route(
+        self,
+        messages: List[Dict[str, str]],
+        task_type: Optional[TaskType],
+        model_override: Optional[str]
+    ) -> Tuple[Optional[TaskType], str, Dict]:
+        """
+        Resolve task type and model for a request
+        Returns: (task_type, model_key, model_config)
+        """
+        # Detect task type if not provided
+        if task_type is None and messages:
+            last_message = messages[-1]["content"]
+            task_type = self.detect_task_type(last_message, _recent(messages, 10)[:-1])
         
-        # Sort by priority (lower is better)
-        candidates.sort(key=lambda x: x[1]["priority"])
+        # Select model
+        if model_override and model_override in self.models:
+            model_key = model_override
+            model_config = self.models[model_override]
+        else:
+            model_key, model_config = self.select_model(task_type or TaskType.GENERAL_CHAT)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Task=%s Model=%s (%s)",
+                self._task_values.get(task_type, "general"), model_key, model_config["id"]
+            )
         
-        return candidates[0] if candidates else (self.default_model, self.models[self.default_model])
+        return task_type, model_key, model_config
     
     def generate_response(
         self, 
@@ -177,107 +333,307 @@ class ModelRouter:
         Returns:
             Dict with 'content', 'model_used', 'task_type'
         """
-        # Detect task type if not provided
-        if task_type is None and messages:
-            last_message = messages[-1]["content"]
-            task_type = self.detect_task_type(last_message, messages[:-1])
+        task_type, model_key, model_config = self._route(messages, task_type, model_override)
+        model_id = model_config["id"]
         
-        # Select model
-        if model_override and model_override in self.models:
-            model_key = model_override
-            model_config = self.models[model_override]
-        else:
-            model_key, model_config = self.select_model(task_type or TaskType.GENERAL_CHAT)
+        key = None
+        if temperature <= CACHE_MAX_TEMPERATURE:
+            key = self._request_key(model_id, messages, max_tokens, temperature)
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
         
-        model_id = model_config["id"]
-        format_type = model_config["format"]
+        result = self._call_api(model_config, messages, max_tokens, temperature, model_key, task_type)
         
-        print(f"🎯 Task: {task_type.value if task_type else 'general'}")
-        print(f"🤖 Selected Model: {model_key} ({model_id})")
+        if key is not None:
+            self._cache_put(key, result)
+        return result
+    
+    async def agenerate_response(
+        self, 
+        messages: List[Dict[str, str]], 
+        task_type: Optional[TaskType] = None,
+        model_override: Optional[str] = None,
+        max_tokens: int = 500,
+        temperature: float = 0.7
+    ) -> Dict:
+        """
+        Async variant of generate_response for event-loop callers
+        (FastAPI, async Gradio handlers); many turns share one HTTP/2 connection
         
-        # Call appropriate API format
-        if format_type == "chat":
-            return self._call_chat_api(model_id, messages, max_tokens, temperature, model_key, task_type)
+        Without a model override, a cold (503), retired (410) or stalled
+        primary falls through to the next candidate for the task.
+        """
+        task_type, model_key, model_config = self._route(messages, task_type, model_override)
+        model_id = model_config["id"]
+        
+        if model_override in self.models:
+            candidates = [(model_key, model_config)]
         else:
-            return self._call_standard_api(model_id, messages, max_tokens, temperature, model_key, task_type)
+            candidates = self._by_task.get(task_type or TaskType.GENERAL_CHAT) or [(model_key, model_config)]
+        candidates = candidates[:MAX_CANDIDATES]
+        
+        key = self._request_key(model_id, messages, max_tokens, temperature)
+        cacheable = temperature <= CACHE_MAX_TEMPERATURE
+        if cacheable:
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
+        
+        result = await self._coalesce(
+            key, lambda: self._try_candidates(candidates, messages, max_tokens, temperature, task_type)
+        )
+        
+        # The key names the primary model: a backup's answer must not be
+        # served for it once the primary is warm again
+        if cacheable and result.get("model_id") == model_id:
+            self._cache_put(key, result)
+        return result
     
-    def _call_chat_api(
-        self, 
-        model_id: str, 
-        messages: List[Dict], 
-        max_tokens: int, 
+    async def _try_candidates(
+        self,
+        candidates: List[Tuple[str, Dict]],
+        messages: List[Dict],
+        max_tokens: int,
         temperature: float,
-        model_key: str,
         task_type: Optional[TaskType]
     ) -> Dict:
-        """Call OpenAI-compatible chat completion API"""
-        url = f"{self.base_url}/{model_id}/v1/chat/completions"
+        """
+        Call candidate models in priority order, starting the next one when the
+        latest fails or misses HEDGE_DELAY; calls already in flight keep running
+        Returns the first successful response, or the primary model's error
+        """
+        tasks: List[asyncio.Future] = []
+        pending: set = set()
+        try:
+            for model_key, model_config in candidates:
+                latest = asyncio.ensure_future(
+                    self._acall_api(model_config, messages, max_tokens, temperature, model_key, task_type)
+                )
+                tasks.append(latest)
+                pending.add(latest)
+                
+                # Wait for a success, the latest call failing, or the hedge delay
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, timeout=HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.result()["status"] == "success":
+                            return task.result()
+                    if not done or latest in done:
+                        break
+            
+            # Every candidate started: take the first success among those left
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result()["status"] == "success":
+                        return task.result()
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def stream_response(
+        self, 
+        messages: List[Dict[str, str]], 
+        task_type: Optional[TaskType] = None,
+        model_override: Optional[str] = None,
+        max_tokens: int = 500,
+        temperature: float = 0.7
+    ) -> Iterator[str]:
+        """
+        Generate a response as a stream of text deltas
         
-        headers = {
-            "Authorization": f"Bearer {self.hf_api_key}",
-            "Content-Type": "application/json"
-        }
+        Chat-format models stream over SSE so the first tokens arrive as soon
+        as they are generated; standard-format models yield the full reply once.
+        Errors are yielded as their user-facing message.
+        """
+        task_type, model_key, model_config = self._route(messages, task_type, model_override)
+        model_id = model_config["id"]
+        
+        if model_config["format"] != "chat":
+            yield self._call_api(model_config, messages, max_tokens, temperature, model_key, task_type)["content"]
+            return
+        
+        url, payload = self._chat_request(model_id, messages, max_tokens, temperature)
+        payload["stream"] = True
+        
+        try:
+            with self.session.post(
+                url, headers=self._headers, data=orjson.dumps(payload), stream=True, timeout=30
+            ) as response:
+                if response.status_code != 200:
+                    yield self._handle_error(response, model_key)["content"]
+                    return
+                
+                # text/event-stream carries no charset, which requests would
+                # otherwise decode as ISO-8859-1; SSE is always UTF-8
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    delta = self._parse_stream_line(line)
+                    if delta:
+                        yield delta
+        
+        except (requests.RequestException, ValueError) as e:
+            yield self._exception_result(e, model_id, model_key, task_type)["content"]
+    
+    async def astream_response(
+        self, 
+        messages: List[Dict[str, str]], 
+        task_type: Optional[TaskType] = None,
+        model_override: Optional[str] = None,
+        max_tokens: int = 500,
+        temperature: float = 0.7
+    ) -> AsyncIterator[str]:
+        """Async variant of stream_response"""
+        task_type, model_key, model_config = self._route(messages, task_type, model_override)
+        model_id = model_config["id"]
+        
+        if model_config["format"] != "chat":
+            result = await self._acall_api(model_config, messages, max_tokens, temperature, model_key, task_type)
+            yield result["content"]
+            return
+        
+        url, payload = self._chat_request(model_id, messages, max_tokens, temperature)
+        payload["stream"] = True
+        
+        try:
+            async with self._client.stream("POST", url, content=orjson.dumps(payload)) as response:
+                if response.status_code != 200:
+                    if response.status_code not in ERROR_MESSAGES:
+                        await response.aread()
+                    yield self._handle_error(response, model_key)["content"]
+                    return
+                
+                async for line in response.aiter_lines():
+                    delta = self._parse_stream_line(line)
+                    if delta:
+                        yield delta
+        
+        except (httpx.HTTPError, ValueError) as e:
+            yield self._exception_result(e, model_id, model_key, task_type)["content"]
+    
+    @staticmethod
+    def _parse_stream_line(line: str) -> Optional[str]:
+        """Extract the content delta from one SSE line of a streamed chat completion"""
+        if not line or not line.startswith("data:"):
+            return None
+        
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return None
+        
+        try:
+            chunk = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return None
+        
+        choices = chunk.get("choices")
+        if not choices:
+            return None
+        return choices[0].get("delta", {}).get("content")
+    
+    def _cache_get(self, key: bytes) -> Optional[Dict]:
+        """Return a copy of a cached response, or None"""
+        with self._cache_lock:
+            result = self._response_cache.get(key)
+        return dict(result) if result is not None else None
+    
+    def _cache_put(self, key: bytes, result: Dict) -> None:
+        """Cache a response if it succeeded"""
+        if result.get("status") == "success":
+            with self._cache_lock:
+                self._response_cache[key] = dict(result)
+    
+    @staticmethod
+    def _request_key(model_id: str, messages: List[Dict], max_tokens: int, temperature: float) -> bytes:
+        """Stable digest identifying a request to a model (only the last 10 messages are sent)"""
+        raw = json.dumps(
+            {"m": model_id, "msgs": _recent(messages, 10), "t": temperature, "mt": max_tokens},
+            sort_keys=True
+        ).encode()
+        return hashlib.blake2b(raw, digest_size=16).digest()
+    
+    async def _coalesce(self, key: bytes, start_call) -> Dict:
+        """
+        Run start_call() unless an identical request is already in flight,
+        in which case share its result (double submits, retries, users
+        sending the same prompt at the same time)
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start_call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shield so one caller going away does not cancel the call for the others
+        return await asyncio.shield(task)
+    
+    async def aclose(self):
+        """Close the async HTTP client"""
+        await self._client.aclose()
+    
+    def _chat_request(
+        self,
+        model_id: str,
+        messages: List[Dict],
+        max_tokens: int,
+        temperature: float
+    ) -> Tuple[str, Dict]:
+        """Build URL and payload for the OpenAI-compatible chat completion API"""
+        url = self._chat_urls[model_id]
         
         payload = {
-            "messages": messages[-10:],  # Last 5 exchanges
+            "messages": _recent(messages, 10),  # Last 5 exchanges
             "max_tokens": max_tokens,
             "temperature": temperature,
             "top_p": 0.9,
             "stream": False
         }
-        
+        return url, payload
+    
+    def _parse_chat_result(
+        self,
+        result: Dict,
+        model_id: str,
+        model_key: str,
+        task_type: Optional[TaskType]
+    ) -> Optional[Dict]:
+        """Extract the reply from a chat completion, or None if it is empty or malformed"""
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if "choices" in result and len(result["choices"]) > 0:
-                    content = result["choices"][0].get("message", {}).get("content", "")
-                    if content:
-                        return {
-                            "content": content.strip(),
-                            "model_used": model_key,
-                            "model_id": model_id,
-                            "task_type": task_type.value if task_type else "general",
-                            "status": "success"
-                        }
-            
-            return self._handle_error(response.status_code, response.text, model_key)
-            
-        except Exception as e:
+            content = result["choices"][0]["message"]["content"].strip()
+        except (LookupError, TypeError, AttributeError):
+            return None
+        
+        if content:
             return {
-                "content": f"❌ Error: {str(e)[:100]}",
+                "content": content,
                 "model_used": model_key,
                 "model_id": model_id,
-                "task_type": task_type.value if task_type else "general",
-                "status": "error"
+                "task_type": self._task_values.get(task_type, "general"),
+                "status": "success"
             }
+        return None
     
-    def _call_standard_api(
-        self, 
-        model_id: str, 
-        messages: List[Dict], 
-        max_tokens: int, 
-        temperature: float,
-        model_key: str,
-        task_type: Optional[TaskType]
-    ) -> Dict:
-        """Call standard HF Inference API"""
-        url = f"{self.base_url}/{model_id}"
-        
-        headers = {
-            "Authorization": f"Bearer {self.hf_api_key}",
-            "Content-Type": "application/json"
-        }
+    def _standard_request(
+        self,
+        model_id: str,
+        messages: List[Dict],
+        max_tokens: int,
+        temperature: float
+    ) -> Tuple[str, Dict]:
+        """Build URL and payload for the standard HF Inference API"""
+        url = self._standard_urls[model_id]
         
         # Build conversation text
-        conversation_text = ""
-        for msg in messages[-6:]:
-            if msg["role"] == "user":
-                conversation_text += f"User: {msg['content']}\n"
-            else:
-                conversation_text += f"Assistant: {msg['content']}\n"
-        conversation_text += "Assistant:"
+        parts = [
+            f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+            for msg in _recent(messages, 6)
+        ]
+        parts.append("Assistant:")
+        conversation_text = "".join(parts)
         
         payload = {
             "inputs": conversation_text,
@@ -288,56 +644,120 @@ class ModelRouter:
                 "return_full_text": False
             }
         }
-        
+        return url, payload
+    
+    def _parse_standard_result(
+        self,
+        result,
+        model_id: str,
+        model_key: str,
+        task_type: Optional[TaskType]
+    ) -> Optional[Dict]:
+        """Extract generated text from a standard API response, or None if it is empty or malformed"""
+        first = result[0] if isinstance(result, list) and result else result
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                
-                if isinstance(result, list) and len(result) > 0:
-                    generated = result[0].get("generated_text", "")
-                elif isinstance(result, dict):
-                    generated = result.get("generated_text", "")
-                else:
-                    generated = ""
-                
-                if generated:
-                    # Clean up response
-                    generated = generated.strip()
-                    if "\nUser:" in generated:
-                        generated = generated.split("\nUser:")[0].strip()
-                    
-                    return {
-                        "content": generated,
-                        "model_used": model_key,
-                        "model_id": model_id,
-                        "task_type": task_type.value if task_type else "general",
-                        "status": "success"
-                    }
-            
-            return self._handle_error(response.status_code, response.text, model_key)
+            generated = first["generated_text"].strip()
+        except (LookupError, TypeError, AttributeError):
+            return None
+        
+        if generated:
+            # Clean up response
+            end = generated.find("\nUser:")
+            if end >= 0:
+                generated = generated[:end].strip()
             
-        except Exception as e:
             return {
-                "content": f"❌ Error: {str(e)[:100]}",
+                "content": generated,
                 "model_used": model_key,
                 "model_id": model_id,
-                "task_type": task_type.value if task_type else "general",
-                "status": "error"
+                "task_type": self._task_values.get(task_type, "general"),
+                "status": "success"
             }
+        return None
     
-    def _handle_error(self, status_code: int, error_text: str, model_key: str) -> Dict:
-        """Handle API errors with user-friendly messages"""
-        error_messages = {
-            503: "⏳ Model is loading (first request takes ~20 seconds). Please try again!",
-            401: "🔑 API authentication failed. Please check your Hugging Face token.",
-            403: "🔑 API authentication failed. Please check your Hugging Face token.",
-            429: "⏸️ Rate limit reached. Please wait a moment and try again.",
-            410: "⚠️ Model endpoint is no longer available. Trying fallback model..."
+    def _exception_result(
+        self,
+        error: Exception,
+        model_id: str,
+        model_key: str,
+        task_type: Optional[TaskType]
+    ) -> Dict:
+        """Turn a transport exception into an error response"""
+        return {
+            "content": f"❌ Error: {str(error)[:100]}",
+            "model_used": model_key,
+            "model_id": model_id,
+            "task_type": self._task_values.get(task_type, "general"),
+            "status": "error"
         }
+    
+    def _call_api(
+        self, 
+        model_config: Dict, 
+        messages: List[Dict], 
+        max_tokens: int, 
+        temperature: float,
+        model_key: str,
+        task_type: Optional[TaskType]
+    ) -> Dict:
+        """Call a model through the request builder and parser for its API format"""
+        model_id = model_config["id"]
+        build, parse = self._formats[model_config["format"]]
+        url, payload = build(model_id, messages, max_tokens, temperature)
         
-        content = error_messages.get(status_code, f"⚠️ AI service error ({status_code}). Please try again.")
+        try:
+            response = self.session.post(url, headers=self._headers, data=orjson.dumps(payload), timeout=30)
+            
+            if response.status_code == 200:
+                result = parse(orjson.loads(response.content), model_id, model_key, task_type)
+                if result:
+                    return result
+            
+            return self._handle_error(response, model_key)
+            
+        except (requests.RequestException, ValueError) as e:
+            return self._exception_result(e, model_id, model_key, task_type)
+    
+    async def _acall_api(
+        self, 
+        model_config: Dict, 
+        messages: List[Dict], 
+        max_tokens: int, 
+        temperature: float,
+        model_key: str,
+        task_type: Optional[TaskType]
+    ) -> Dict:
+        """Async variant of _call_api, without blocking the event loop"""
+        model_id = model_config["id"]
+        build, parse = self._formats[model_config["format"]]
+        url, payload = build(model_id, messages, max_tokens, temperature)
+        
+        try:
+            response = await self._client.post(url, content=orjson.dumps(payload))
+            
+            if response.status_code == 200:
+                result = parse(orjson.loads(response.content), model_id, model_key, task_type)
+                if result:
+                    return result
+            
+            return self._handle_error(response, model_key)
+            
+        except (httpx.HTTPError, ValueError) as e:
+            return self._exception_result(e, model_id, model_key, task_type)
+    
+    def _handle_error(self, response, model_key: str) -> Dict:
+        """
+        Handle API errors with user-friendly messages
+        The response body is only decoded (and logged) for unexpected statuses
+        """
+        status_code = response.status_code
+        content = ERROR_MESSAGES.get(status_code)
+        if content is None:
+            content = f"⚠️ AI service error ({status_code}). Please try again."
+            logger.warning(
+                "HF API error %s from %s: %s",
+                status_code, model_key, response.content[:200].decode("utf-8", "replace")
+            )
         
         return {
             "content": content,
@@ -348,13 +768,5 @@ class ModelRouter:
         }
     
     def list_available_models(self) -> List[Dict]:
-        """Get list of all available models with their capabilities"""
-        return [
-            {
-                "key": key,
-                "id": config["id"],
-                "tasks": [t.value for t in config["tasks"]],
-                "priority": config["priority"]
-            }
-            for key, config in self.models.items()
-        ]
+        """Get list of all available models with their capabilities (shared; do not mutate)"""
+        return self._models_summary
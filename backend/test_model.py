@@ -2,6 +2,7 @@
 Quick test script to verify model is working
 Run this before starting the full backend
 """
+import os
 import torch
 from transformers import pipeline, AutoTokenizer
 from huggingface_hub import login
@@ -29,6 +30,8 @@ if torch.cuda.is_available():
 # Test 2: Load Model
 print("\n[2/4] Loading model (this may take 2-5 minutes first time)...")
 MODEL_ID = "meta-llama/Llama-3.2-1B-Instruct"  # Best quality model!
+# bfloat16 halves GPU memory; keep float32 on CPU where bf16 matmuls are often slow
+DTYPE = torch.bfloat16 if torch.cuda.is_available() else torch.float32
 
 try:
     tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, token=HF_TOKEN)
@@ -40,6 +43,8 @@ try:
         model=MODEL_ID,
         tokenizer=tokenizer,
         device_map="auto",
+        torch_dtype=DTYPE,
+        model_kwargs={"attn_implementation": "sdpa"},
         token=HF_TOKEN,
     )
     print(f"✓ Model loaded: {MODEL_ID}")
@@ -57,6 +62,7 @@ except Exception as e:
         model=MODEL_ID,
         tokenizer=tokenizer,
         device_map="auto",
+        torch_dtype=DTYPE,
     )
     print(f"✓ Fallback model loaded: {MODEL_ID}")
 
@@ -78,31 +84,35 @@ try:
         else:
             prompt = f"User: {test_input}\nAssistant:"
         
-        output = pipe(
-            prompt,
-            max_new_tokens=100,
-            do_sample=True,
-            temperature=0.7,
-            top_p=0.9,
-        )
+        with torch.inference_mode():
+            output = pipe(
+                prompt,
+                max_new_tokens=100,
+                do_sample=True,
+                temperature=0.7,
+                top_p=0.9,
+            )
         response = output[0]["generated_text"][len(prompt):].strip()
-        if "<|eot_id|>" in response:
-            response = response.split("<|eot_id|>")[0].strip()
+        end = response.find("<|eot_id|>")
+        if end >= 0:
+            response = response[:end].strip()
     else:
         # DialoGPT format
-        output = pipe(
-            test_input + tokenizer.eos_token,
-            max_new_tokens=50,
-            do_sample=True,
-            temperature=0.8,
-            top_k=50,
-            top_p=0.95,
-            pad_token_id=tokenizer.eos_token_id,
-        )
+        with torch.inference_mode():
+            output = pipe(
+                test_input + tokenizer.eos_token,
+                max_new_tokens=50,
+                do_sample=True,
+                temperature=0.8,
+                top_k=50,
+                top_p=0.95,
+                pad_token_id=tokenizer.eos_token_id,
+            )
         response = output[0]["generated_text"]
         response = response[len(test_input):].strip()
-        if tokenizer.eos_token in response:
-            response = response.split(tokenizer.eos_token)[0].strip()
+        end = response.find(tokenizer.eos_token)
+        if end >= 0:
+            response = response[:end].strip()
     
     print(f"Response: {response}")
     print("✓ Generation successful!")
@@ -1,58 +1,76 @@
 import gradio as gr
-import requests
+import httpx
 import json
+import orjson
 from datetime import datetime
+from chat_utils import CONCURRENCY_LIMIT, QUEUE_MAX_SIZE
 
 # Hugging Face API Configuration
 HF_API_KEY = "your-hugging-face-api-key-here"
 HF_API_URL = "https://api-inference.huggingface.co/models/meta-llama/Llama-3.2-1B-Instruct/v1/chat/completions"
+HF_HEADERS = {
+    "Authorization": f"Bearer {HF_API_KEY}",
+    "Content-Type": "application/json"
+}
+
+# One keep-alive HTTP/2 client for the whole app: concurrent chats are
+# multiplexed over a single TLS connection instead of one each.
+# It lives as long as the process.
+CLIENT = httpx.AsyncClient(http2=True, timeout=30.0, headers=HF_HEADERS)
 
 # Store conversation history
 conversation_history = []
 
-def generate_response(message, context_messages):
+async def generate_response(message, context_messages):
     """
-    Generate AI response using Hugging Face Inference API
+    Stream an AI response from the Hugging Face Inference API
+    Yields text deltas as they arrive
     """
-    # Build full message list
-    messages = context_messages + [{"role": "user", "content": message}]
-    
-    headers = {
-        "Authorization": f"Bearer {HF_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # Last 5 exchanges: the 9 most recent context messages plus the new one
+    messages = context_messages[-9:]
+    messages.append({"role": "user", "content": message})
     
     payload = {
-        "messages": messages[-10:],  # Last 5 exchanges
+        "messages": messages,
         "max_tokens": 500,
         "temperature": 0.7,
         "top_p": 0.9,
-        "stream": False
+        "stream": True
     }
     
     try:
-        response = requests.post(HF_API_URL, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
+        async with CLIENT.stream("POST", HF_API_URL, content=orjson.dumps(payload)) as response:
+            if response.status_code == 503:
+                yield "⏳ The AI model is loading (first request takes ~20 seconds). Please try again!"
+                return
+            elif response.status_code == 401 or response.status_code == 403:
+                yield "🔑 API authentication issue. Please check the token permissions."
+                return
+            elif response.status_code != 200:
+                yield f"⚠️ Error {response.status_code}. Please try again."
+                return
             
-            # Parse OpenAI-compatible response
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0].get("message", {}).get("content", "")
-                if content:
-                    return content.strip()
+            # Parse OpenAI-compatible server-sent events
+            received = False
+            async for line in response.aiter_lines():
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                
+                chunk = orjson.loads(data)
+                if chunk.get("choices"):
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                    if content:
+                        received = True
+                        yield content
             
-            return "I received your message but couldn't generate a response. Please try again."
-            
-        elif response.status_code == 503:
-            return "⏳ The AI model is loading (first request takes ~20 seconds). Please try again!"
-        elif response.status_code == 401 or response.status_code == 403:
-            return "🔑 API authentication issue. Please check the token permissions."
-        else:
-            return f"⚠️ Error {response.status_code}. Please try again."
+            if not received:
+                yield "I received your message but couldn't generate a response. Please try again."
             
     except Exception as e:
-        return f"❌ Error: {str(e)[:100]}"
+        yield f"❌ Error: {str(e)[:100]}"
 
 # Create Gradio Interface
 with gr.Blocks(title="ChatGPT Clone") as demo:
@@ -102,23 +120,22 @@ with gr.Blocks(title="ChatGPT Clone") as demo:
         history.append({"role": "user", "content": message})
         return "", history
     
-    def bot_response(history):
+    async def bot_response(history):
         if not history or history[-1]["role"] != "user":
-            return history
+            yield history
+            return
         
         user_msg = history[-1]["content"]
         
-        # Get conversation context (exclude the last user message we're responding to)
-        context_messages = []
-        for msg in history[:-1]:
-            context_messages.append(msg)
-        
-        # Generate response
-        bot_msg = generate_response(user_msg, context_messages)
+        # Get conversation context (exclude the last user message we're responding to);
+        # only the most recent turns are sent, so slice that window instead of copying it all
+        context_messages = history[-10:-1]
         
-        # Add assistant response
-        history.append({"role": "assistant", "content": bot_msg})
-        return history
+        # Stream the assistant response into the chat as it arrives
+        history.append({"role": "assistant", "content": ""})
+        async for delta in generate_response(user_msg, context_messages):
+            history[-1]["content"] += delta
+            yield history
     
     def clear_chat():
         return []
@@ -144,5 +161,5 @@ with gr.Blocks(title="ChatGPT Clone") as demo:
 
 # Launch the app
 if __name__ == "__main__":
-    demo.queue()
+    demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT, max_size=QUEUE_MAX_SIZE)
     demo.launch(theme=gr.themes.Soft())
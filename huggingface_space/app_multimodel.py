@@ -4,14 +4,33 @@ Intelligently routes to different models based on task type
 """
 
 import gradio as gr
+import hashlib
+import queue
+import re
+import threading
+import time
 import requests
-import json
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from functools import lru_cache
+from typing import Iterator, List, Dict, Optional, Tuple
 from enum import Enum
+from types import MappingProxyType
+from chat_utils import (
+    CONCURRENCY_LIMIT, EMIT_BOUNDARIES, EMIT_INTERVAL, ERROR_PREFIXES, QUEUE_MAX_SIZE,
+    SEMANTIC_CACHE_ENABLED, SESSION, embed, fit_messages, semantic_lookup, semantic_store,
+    sse_deltas
+)
 
 # Hugging Face API Configuration
 HF_API_KEY = "your-hugging-face-api-key-here"
+HF_API_BASE_URL = "https://api-inference.huggingface.co/models/"
+_HEADERS = {
+    "Authorization": f"Bearer {HF_API_KEY}",
+    "Content-Type": "application/json"
+}
 
 class TaskType(Enum):
     """Task categories for model routing"""
@@ -57,103 +76,125 @@ MODELS = {
     }
 }
 
+# Endpoint per model, formatted once: chat-format models use the
+# OpenAI-compatible route, the rest the standard inference route
+for _config in MODELS.values():
+    _config["url"] = HF_API_BASE_URL + _config["id"]
+    if _config["format"] == "chat":
+        _config["url"] += "/v1/chat/completions"
+
+# Freeze the registry: model configs are read-only from here on
+MODELS = {name: MappingProxyType(config) for name, config in MODELS.items()}
+
+# Sidebar model list, rendered as a single Markdown block
+_MODEL_LIST_MD = "### Available Models:\n\n" + "\n\n".join(
+    f"**{name}**  \n{config['description']}" for name, config in MODELS.items()
+)
+
+# Candidate models per task, in registry (preference) order, resolved once
+_TASK_CANDIDATES: Dict[str, List[Tuple[str, Dict]]] = {}
+for _name, _config in MODELS.items():
+    for _task in _config["tasks"]:
+        _TASK_CANDIDATES.setdefault(_task, []).append((_name, _config))
+_TASK_TO_MODEL = {task: candidates[0] for task, candidates in _TASK_CANDIDATES.items()}
+
+# Task detection keywords, compiled once into one case-insensitive regex per
+# category. Keywords must start a word ("api" does not fire on "rapid") but may
+# carry a suffix, so plurals and inflections ("functions", "poems") still count;
+# a lookbehind instead of \b so "c++" matches.
+def _keyword_regex(keywords: List[str]) -> "re.Pattern":
+    alternation = "|".join(re.escape(k) for k in keywords)
+    return re.compile(rf"(?<!\w)(?:{alternation})\w*", re.IGNORECASE)
+
+_CODE_RE = _keyword_regex(["code", "function", "class", "debug", "error", "python", "javascript",
+                           "java", "c++", "programming", "algorithm", "api", "sql", "html", "css"])
+_MATH_RE = _keyword_regex(["calculate", "solve", "equation", "math", "proof", "logic",
+                           "reasoning", "analyze", "theorem", "formula"])
+_CREATIVE_RE = _keyword_regex(["write", "story", "poem", "creative", "imagine", "describe",
+                               "narrative", "character", "plot"])
+
+@lru_cache(maxsize=512)
 def detect_task_type(message: str) -> str:
     """Detect the task type from message content"""
-    message_lower = message.lower()
-    
     # Coding detection
-    code_keywords = ["code", "function", "class", "debug", "error", "python", "javascript", 
-                    "java", "c++", "programming", "algorithm", "api", "sql", "html", "css"]
-    if any(keyword in message_lower for keyword in code_keywords):
+    if _CODE_RE.search(message):
         return "coding"
     
     # Math/Reasoning detection
-    math_keywords = ["calculate", "solve", "equation", "math", "proof", "logic", 
-                    "reasoning", "analyze", "theorem", "formula"]
-    if any(keyword in message_lower for keyword in math_keywords):
+    if _MATH_RE.search(message):
         return "reasoning"
     
     # Creative writing detection
-    creative_keywords = ["write", "story", "poem", "creative", "imagine", "describe",
-                       "narrative", "character", "plot"]
-    if any(keyword in message_lower for keyword in creative_keywords):
+    if _CREATIVE_RE.search(message):
         return "creative"
     
-    # Multilingual detection
-    if any(ord(char) > 127 for char in message):
+    # Multilingual detection (any non-ASCII character)
+    if not message.isascii():
         return "multilingual"
     
-    # Fast response for short queries
-    if len(message.split()) < 10:
+    # Fast response for short queries (fewer than 10 words), counted without splitting
+    if message.count(" ") < 9:
         return "fast_response"
     
     return "general_chat"
 
+def conversation_task_type(message: str, history: List[Dict]) -> str:
+    """
+    Detect the task type for a turn in context: a short follow-up with no
+    task keywords ("yes", "go on") keeps the task of the latest longer user turn
+    """
+    task_type = detect_task_type(message)
+    if task_type != "fast_response" or message.count(" ") >= 2:
+        return task_type
+    
+    for msg in reversed(history):
+        if msg["role"] == "user" and msg["content"].count(" ") >= 2:
+            return detect_task_type(msg["content"])
+    return task_type
+
+def model_candidates(task_type: str) -> List[Tuple[str, Dict]]:
+    """All models that support the task, in registry (preference) order"""
+    return _TASK_CANDIDATES.get(task_type, [])
+
 def select_model(task_type: str, model_override: Optional[str] = None) -> Tuple[str, Dict]:
     """Select the best model for the task"""
     if model_override and model_override in MODELS:
         return model_override, MODELS[model_override]
     
-    # Find models that support this task
-    for name, config in MODELS.items():
-        if task_type in config["tasks"]:
-            return name, config
-    
-    # Default fallback
-    return "Mistral 7B (Fast)", MODELS["Mistral 7B (Fast)"]
+    # First model that supports this task, else the default fallback
+    return _TASK_TO_MODEL.get(task_type) or ("Mistral 7B (Fast)", MODELS["Mistral 7B (Fast)"])
 
-def call_chat_api(model_id: str, messages: List[Dict], max_tokens: int = 500) -> str:
-    """Call OpenAI-compatible chat API"""
-    url = f"https://api-inference.huggingface.co/models/{model_id}/v1/chat/completions"
-    
-    headers = {
-        "Authorization": f"Bearer {HF_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "messages": messages[-10:],
+def _chat_payload(messages: List[Dict], max_tokens: int) -> Dict:
+    """Build a streaming request body for the OpenAI-compatible chat API"""
+    return {
+        "messages": fit_messages(messages),
         "max_tokens": max_tokens,
         "temperature": 0.7,
         "top_p": 0.9,
-        "stream": False
+        "stream": True
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0].get("message", {}).get("content", "")
-                if content:
-                    return content.strip()
-        
-        return handle_error(response.status_code)
-        
-    except Exception as e:
-        return f"❌ Error: {str(e)[:100]}"
 
-def call_standard_api(model_id: str, messages: List[Dict], max_tokens: int = 500) -> str:
-    """Call standard HF Inference API"""
-    url = f"https://api-inference.huggingface.co/models/{model_id}"
+def _read_chat(response: requests.Response) -> Iterator[str]:
+    """Yield text deltas from a streamed chat completion"""
+    received = False
+    for content in sse_deltas(response.iter_lines()):
+        received = True
+        yield content
     
-    headers = {
-        "Authorization": f"Bearer {HF_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    if not received:
+        yield handle_error(response.status_code)
+
+def _standard_payload(messages: List[Dict], max_tokens: int) -> Dict:
+    """Build a request body for the standard HF Inference API"""
+    # Build conversation text: one "Role: content" line per message
+    parts = [
+        ("User: " if msg["role"] == "user" else "Assistant: ") + msg["content"]
+        for msg in fit_messages(messages)
+    ]
+    parts.append("Assistant:")
     
-    # Build conversation text
-    conversation_text = ""
-    for msg in messages[-6:]:
-        if msg["role"] == "user":
-            conversation_text += f"User: {msg['content']}\n"
-        else:
-            conversation_text += f"Assistant: {msg['content']}\n"
-    conversation_text += "Assistant:"
-    
-    payload = {
-        "inputs": conversation_text,
+    return {
+        "inputs": "\n".join(parts),
         "parameters": {
             "max_new_tokens": max_tokens,
             "temperature": 0.7,
@@ -161,66 +202,253 @@ def call_standard_api(model_id: str, messages: List[Dict], max_tokens: int = 500
             "return_full_text": False
         }
     }
+
+def _read_standard(response: requests.Response) -> Iterator[str]:
+    """Yield the whole generated text of a standard API reply (an error message if it has none)"""
+    result = orjson.loads(response.content)
+    first = result[0] if isinstance(result, list) and result else result
+    try:
+        generated = first["generated_text"].strip()
+    except (LookupError, TypeError, AttributeError):
+        generated = ""
+    
+    if "\nUser:" in generated:
+        generated = generated.split("\nUser:")[0].strip()
+    yield generated or handle_error(response.status_code)
+
+# API format -> (request body builder, response reader)
+_FORMATS = {
+    "chat": (_chat_payload, _read_chat),
+    "standard": (_standard_payload, _read_standard),
+}
+
+def stream_model(model_config: Dict, messages: List[Dict], max_tokens: int = 500) -> Iterator[str]:
+    """Stream a model's reply as text deltas, whatever its API format"""
+    build, read = _FORMATS[model_config["format"]]
+    payload = build(messages, max_tokens)
     
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            if isinstance(result, list) and len(result) > 0:
-                generated = result[0].get("generated_text", "")
-            elif isinstance(result, dict):
-                generated = result.get("generated_text", "")
-            else:
-                generated = ""
-            
-            if generated:
-                generated = generated.strip()
-                if "\nUser:" in generated:
-                    generated = generated.split("\nUser:")[0].strip()
-                return generated
-        
-        return handle_error(response.status_code)
-        
-    except Exception as e:
-        return f"❌ Error: {str(e)[:100]}"
+        with SESSION.post(model_config["url"], headers=_HEADERS, data=orjson.dumps(payload), stream=True, timeout=30) as response:
+            response.raise_for_status()
+            yield from read(response)
+    except requests.HTTPError as e:
+        yield handle_error(e.response.status_code)
+    except requests.Timeout:
+        yield TIMEOUT_MESSAGE
+    except requests.ConnectionError:
+        yield CONNECTION_MESSAGE
+    except (requests.RequestException, ValueError) as e:
+        yield f"❌ Error: {str(e)[:100]}"
+
+TIMEOUT_MESSAGE = "⏳ The model took too long to respond. Please try again."
+CONNECTION_MESSAGE = "🌐 Could not reach the Hugging Face API. Please try again."
+ERROR_MESSAGES = {
+    503: "⏳ Model is loading (first request takes ~20 seconds). Please try again!",
+    401: "🔑 API authentication failed.",
+    403: "🔑 API authentication failed.",
+    429: "⏸️ Rate limit reached. Please wait a moment.",
+}
 
 def handle_error(status_code: int) -> str:
     """Handle API errors"""
-    error_messages = {
-        503: "⏳ Model is loading (first request takes ~20 seconds). Please try again!",
-        401: "🔑 API authentication failed.",
-        403: "🔑 API authentication failed.",
-        429: "⏸️ Rate limit reached. Please wait a moment.",
-    }
-    return error_messages.get(status_code, f"⚠️ Error {status_code}. Please try again.")
+    message = ERROR_MESSAGES.get(status_code)
+    if message is None:
+        message = f"⚠️ Error {status_code}. Please try again."
+    return message
+
+def _warmup_model(config) -> None:
+    """Send a one-token request so the Inference API loads the model"""
+    build, _ = _FORMATS[config["format"]]
+    payload = build([{"role": "user", "content": "hi"}], 1)
+    try:
+        SESSION.post(config["url"], headers=_HEADERS, data=orjson.dumps(payload), timeout=60).close()
+    except requests.RequestException:
+        pass
+
+def _warmup() -> None:
+    """Wake every model in the background so the first user turn skips the cold-start 503"""
+    for config in MODELS.values():
+        threading.Thread(target=_warmup_model, args=(config,), daemon=True).start()
+
+# Exact response cache keyed by model and the conversation window sent to it,
+# so identical conversation branches are answered without a round trip.
+# Retry bypasses it and replaces the entry.
+PREFIX_CACHE_SIZE = 256
+_prefix_cache: "OrderedDict[bytes, Tuple[str, str]]" = OrderedDict()  # -> (model used, response)
+_prefix_lock = threading.Lock()
+
+def prefix_key(model_id: str, messages: List[Dict]) -> bytes:
+    """Digest of the model and the context window sent to it (everything a request depends on)"""
+    raw = orjson.dumps({"model": model_id, "messages": fit_messages(messages)}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+def prefix_lookup(key: bytes) -> Optional[Tuple[str, str]]:
+    with _prefix_lock:
+        response = _prefix_cache.get(key)
+        if response is not None:
+            _prefix_cache.move_to_end(key)
+        return response
+
+def prefix_store(key: bytes, model_used: str, response: str):
+    if not response or response.startswith(ERROR_PREFIXES):
+        return
+    with _prefix_lock:
+        _prefix_cache[key] = (model_used, response)
+        _prefix_cache.move_to_end(key)
+        while len(_prefix_cache) > PREFIX_CACHE_SIZE:
+            _prefix_cache.popitem(last=False)
+
+# Auto mode brings in the next candidate only when the current one fails, or
+# when both stream (chat format) and no first token arrived within HEDGE_DELAY.
+# A standard-format reply arrives whole, so it is never hedged on time: that
+# would hand nearly every turn to a streaming backup.
+HEDGE_DELAY = 2.0
+
+# Worker threads for hedged model calls: up to two per concurrent chat
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=2 * CONCURRENCY_LIMIT, thread_name_prefix="model-hedge")
+
+def hedge_models(candidates: List[Tuple[str, Dict]], messages: List[Dict]) -> Iterator[Tuple[str, str]]:
+    """
+    Stream from the first candidate, starting the next one when it fails or
+    (both streaming) misses HEDGE_DELAY. Commits to the first candidate whose
+    first chunk is not an error; any other is abandoned. If every candidate
+    fails, the first one's error is yielded. Yields: (model_name, delta)
+    """
+    events: "queue.Queue[Tuple[int, Optional[str]]]" = queue.Queue()
+    stops = [threading.Event() for _ in candidates]
+    
+    def pump(index: int, model_config: Dict):
+        try:
+            for delta in stream_model(model_config, messages):
+                if stops[index].is_set():
+                    break
+                events.put((index, delta))
+        finally:
+            events.put((index, None))
+    
+    started = 0
+    
+    def start_next() -> None:
+        nonlocal started
+        if started < len(candidates):
+            _HEDGE_POOL.submit(pump, started, candidates[started][1])
+            started += 1
+    
+    def hedge_timeout() -> Optional[float]:
+        if started < len(candidates) and all(
+            config["format"] == "chat" for _, config in candidates[started - 1:started + 1]
+        ):
+            return HEDGE_DELAY
+        return None
+    
+    start_next()
+    winner = None
+    errors: Dict[int, str] = {}
+    finished = 0
+    try:
+        while finished < started:
+            try:
+                index, delta = events.get(timeout=hedge_timeout() if winner is None else None)
+            except queue.Empty:
+                start_next()
+                continue
+            
+            if delta is None:
+                finished += 1
+                if index == winner:
+                    return
+                if winner is None and finished == started:
+                    start_next()
+                continue
+            
+            if winner is None:
+                if index in errors or delta.startswith(ERROR_PREFIXES):
+                    errors.setdefault(index, delta)
+                    if index == started - 1:
+                        start_next()
+                    continue
+                winner = index
+                for other, stop in enumerate(stops):
+                    if other != winner:
+                        stop.set()
+            
+            if index == winner:
+                yield candidates[winner][0], delta
+        
+        if winner is None:
+            yield candidates[0][0], errors.get(0, handle_error(0))
+    finally:
+        for stop in stops:
+            stop.set()
 
-def generate_response(message: str, history: List[Dict], model_choice: str = "Auto") -> Tuple[str, str, str]:
+def generate_response(
+    message: str,
+    history: List[Dict],
+    model_choice: str = "Auto",
+    use_cache: bool = True
+) -> Iterator[Tuple[str, str, str]]:
     """
     Generate AI response with automatic model selection
-    Returns: (response_text, model_used, task_detected)
+    Chat-format models stream; the response text grows with each yield
+    use_cache=False always calls the model (retry) and refreshes the caches
+    Yields: (response_text, model_used, task_detected)
     """
     # Detect task type
-    task_type = detect_task_type(message)
+    task_type = conversation_task_type(message, history)
     
-    # Select model
+    # Select model; in Auto mode the second candidate for the task backs up the first
     model_override = None if model_choice == "Auto" else model_choice
     model_name, model_config = select_model(task_type, model_override)
+    candidates = model_candidates(task_type)[:2] if model_override is None else []
     
     # Build messages
-    messages = []
-    for msg in history:
-        messages.append(msg)
-    messages.append({"role": "user", "content": message})
+    messages = [*history, {"role": "user", "content": message}]
+    
+    # Serve repeated conversations, then similar first-turn questions, locally
+    key = prefix_key(model_config["id"], messages)
+    if use_cache:
+        cached = prefix_lookup(key)
+        if cached is not None:
+            yield cached[1], cached[0], task_type
+            return
+    
+    vector = None
+    if SEMANTIC_CACHE_ENABLED and not history:
+        vector = embed(message)
+        cached = semantic_lookup(model_name, vector) if use_cache else None
+        if cached is not None:
+            yield cached[1], cached[0], task_type
+            return
     
     # Generate response
-    if model_config["format"] == "chat":
-        response = call_chat_api(model_config["id"], messages)
+    if len(candidates) >= 2:
+        deltas = hedge_models(candidates, messages)
     else:
-        response = call_standard_api(model_config["id"], messages)
+        deltas = ((model_name, delta) for delta in stream_model(model_config, messages))
+    
+    # Re-render the chat at word/line boundaries or every EMIT_INTERVAL, not per token
+    parts = []
+    model_used = model_name
+    pending = False
+    last_emit = time.monotonic()
+    for model_used, delta in deltas:
+        parts.append(delta)
+        pending = True
+        now = time.monotonic()
+        if delta.endswith(EMIT_BOUNDARIES) or now - last_emit >= EMIT_INTERVAL:
+            last_emit = now
+            pending = False
+            yield "".join(parts).strip(), model_used, task_type
+    response = "".join(parts).strip()
+    if pending:
+        yield response, model_used, task_type
     
-    return response, model_name, task_type
+    # Both caches are keyed by the routed model: a backup's reply must not
+    # be served for it once it is warm again
+    if model_used == model_name:
+        prefix_store(key, model_used, response)
+        if vector is not None:
+            semantic_store(model_name, vector, model_used, response)
 
 # Create Gradio Interface
 with gr.Blocks(title="Multi-Model ChatGPT Clone", theme=gr.themes.Soft()) as demo:
@@ -265,14 +493,7 @@ with gr.Blocks(title="Multi-Model ChatGPT Clone", theme=gr.themes.Soft()) as dem
                 interactive=False
             )
             
-            gr.Markdown(
-                """
-                ### Available Models:
-                """
-            )
-            
-            for name, config in MODELS.items():
-                gr.Markdown(f"**{name}**  \n{config['description']}")
+            gr.Markdown(_MODEL_LIST_MD)
     
     with gr.Row():
         txt = gr.Textbox(
@@ -304,44 +525,53 @@ with gr.Blocks(title="Multi-Model ChatGPT Clone", theme=gr.themes.Soft()) as dem
         if history is None:
             history = []
         
-        # Generate response
-        response, model_used, task = generate_response(message, history, model_choice)
+        context = history[:]
         
-        # Add to history
-        history.append({"role": "user", "content": message})
-        history.append({"role": "assistant", "content": response})
+        # Add both turns at once, then stream the response into the assistant turn
+        history.extend(({"role": "user", "content": message}, {"role": "assistant", "content": ""}))
         
-        return "", history, model_used, task.replace("_", " ").title()
+        for response, model_used, task in generate_response(message, context, model_choice):
+            history[-1]["content"] = response
+            yield "", history, model_used, task.replace("_", " ").title()
     
     def clear_chat():
         return [], "Not started", "None"
     
-    def retry_last(history):
-        if history and len(history) >= 2:
-            if history[-1]["role"] == "assistant":
-                return history[:-1]
-        return history
+    def retry_last(history, model_choice):
+        if not history or len(history) < 2 or history[-1]["role"] != "assistant":
+            yield history, gr.update(), gr.update()
+            return
+        
+        # Regenerate the last answer, bypassing the response caches
+        history = history[:-1]
+        message = history[-1]["content"]
+        context = history[:-1]
+        history.append({"role": "assistant", "content": ""})
+        
+        for response, model_used, task in generate_response(message, context, model_choice, use_cache=False):
+            history[-1]["content"] = response
+            yield history, model_used, task.replace("_", " ").title()
     
     # Event handlers
+    # Queued (the default) so that streamed updates reach the browser
     txt.submit(
         user_message, 
         [txt, chatbot, model_selector], 
-        [txt, chatbot, current_model, task_detected], 
-        queue=False
+        [txt, chatbot, current_model, task_detected]
     )
     
     submit_btn.click(
         user_message, 
         [txt, chatbot, model_selector], 
-        [txt, chatbot, current_model, task_detected], 
-        queue=False
+        [txt, chatbot, current_model, task_detected]
     )
     
     clear_btn.click(clear_chat, None, [chatbot, current_model, task_detected], queue=False)
     
-    retry_btn.click(retry_last, chatbot, chatbot, queue=False)
+    retry_btn.click(retry_last, [chatbot, model_selector], [chatbot, current_model, task_detected])
 
 # Launch the app
 if __name__ == "__main__":
-    demo.queue()
+    demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT, max_size=QUEUE_MAX_SIZE)
+    _warmup()
     demo.launch()
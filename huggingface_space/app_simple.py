@@ -1,46 +1,85 @@
 import gradio as gr
+import time
 import requests
+import orjson
+from chat_utils import (
+    CONCURRENCY_LIMIT, EMIT_BOUNDARIES, EMIT_INTERVAL, QUEUE_MAX_SIZE, SEMANTIC_CACHE_ENABLED,
+    SESSION, embed, fit_messages, semantic_lookup, semantic_store, sse_deltas
+)
 
 # Hugging Face API Configuration
 HF_API_KEY = "your-hugging-face-api-key-here"
-HF_API_URL = "https://api-inference.huggingface.co/models/meta-llama/Llama-3.2-1B-Instruct/v1/chat/completions"
+HF_MODEL_ID = "meta-llama/Llama-3.2-1B-Instruct"
+HF_API_URL = f"https://api-inference.huggingface.co/models/{HF_MODEL_ID}/v1/chat/completions"
+_HEADERS = {
+    "Authorization": f"Bearer {HF_API_KEY}",
+    "Content-Type": "application/json"
+}
 
 def chat(message, history):
-    """Generate AI response"""
+    """Generate AI response, streaming the text as it is generated"""
     # Build messages
-    messages = []
-    for human, assistant in history:
-        messages.append({"role": "user", "content": human})
-        messages.append({"role": "assistant", "content": assistant})
+    messages = [
+        turn
+        for human, assistant in history
+        for turn in ({"role": "user", "content": human}, {"role": "assistant", "content": assistant})
+    ]
     messages.append({"role": "user", "content": message})
     
-    # Call API
-    headers = {
-        "Authorization": f"Bearer {HF_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # Serve repeated first-turn questions locally
+    vector = None
+    if SEMANTIC_CACHE_ENABLED and not history:
+        vector = embed(message)
+        cached = semantic_lookup(HF_MODEL_ID, vector)
+        if cached is not None:
+            yield cached[1]
+            return
     
+    # Call API
     payload = {
-        "messages": messages,
+        "messages": fit_messages(messages),
         "max_tokens": 500,
         "temperature": 0.7,
+        "stream": True,
     }
     
     try:
-        response = requests.post(HF_API_URL, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0].get("message", {}).get("content", "")
-                if content:
-                    return content.strip()
-        elif response.status_code == 503:
-            return "⏳ Model loading... Please try again in 20 seconds!"
-        
-        return f"⚠️ Error {response.status_code}. Please try again."
-    except Exception as e:
-        return f"❌ Error: {str(e)[:100]}"
+        with SESSION.post(HF_API_URL, headers=_HEADERS, data=orjson.dumps(payload), stream=True, timeout=30) as response:
+            response.raise_for_status()
+            
+            # Server-sent events: yield the reply accumulated so far, at word/line
+            # boundaries or every EMIT_INTERVAL rather than per token
+            parts = []
+            pending = False
+            last_emit = time.monotonic()
+            for content in sse_deltas(response.iter_lines()):
+                parts.append(content)
+                pending = True
+                now = time.monotonic()
+                if content.endswith(EMIT_BOUNDARIES) or now - last_emit >= EMIT_INTERVAL:
+                    last_emit = now
+                    pending = False
+                    yield "".join(parts).strip()
+            
+            reply = "".join(parts).strip()
+            if pending:
+                yield reply
+            
+            if not parts:
+                yield f"⚠️ Error {response.status_code}. Please try again."
+            elif vector is not None:
+                semantic_store(HF_MODEL_ID, vector, HF_MODEL_ID, reply)
+    except requests.HTTPError as e:
+        if e.response.status_code == 503:
+            yield "⏳ Model loading... Please try again in 20 seconds!"
+        else:
+            yield f"⚠️ Error {e.response.status_code}. Please try again."
+    except requests.Timeout:
+        yield "⏳ The model took too long to respond. Please try again."
+    except requests.ConnectionError:
+        yield "🌐 Could not reach the Hugging Face API. Please try again."
+    except (requests.RequestException, ValueError) as e:
+        yield f"❌ Error: {str(e)[:100]}"
 
 # Create simple chat interface
 demo = gr.ChatInterface(
@@ -54,4 +93,5 @@ demo = gr.ChatInterface(
 )
 
 if __name__ == "__main__":
+    demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT, max_size=QUEUE_MAX_SIZE)
     demo.launch()
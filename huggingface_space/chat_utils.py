@@ -0,0 +1,127 @@
+"""
+Helpers shared by the Hugging Face Space chat apps
+HTTP session and queue settings, context budgeting, stream parsing and
+throttling, and the optional semantic cache
+"""
+
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pooled session: keeps TCP/TLS connections to the Inference API alive across
+# turns and retries gateway errors / cold starts with a short backoff
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False
+    )
+))
+
+# Up to CONCURRENCY_LIMIT chats generate at once (Gradio's default is one per
+# event); further requests wait in a queue of at most QUEUE_MAX_SIZE
+CONCURRENCY_LIMIT = 16
+QUEUE_MAX_SIZE = 64
+
+# Leading characters of the user-facing error messages the apps produce;
+# replies starting with one are never cached
+ERROR_PREFIXES = ("⏳", "🔑", "⏸️", "⚠️", "❌", "🌐")
+
+# Context sent per request, in tokens, leaving room for the reply within a
+# 4k window. Tokens are estimated at ~4 characters each (plus a few for the
+# role markers), which is close enough for budgeting without a tokenizer.
+CONTEXT_TOKEN_BUDGET = 3500
+
+def fit_messages(messages: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET) -> List[Dict]:
+    """Most recent messages that fit the token budget (always at least the last one)"""
+    total = 0
+    start = len(messages)
+    while start > 0:
+        cost = len(messages[start - 1]["content"]) // 4 + 4
+        if total + cost > budget and start < len(messages):
+            break
+        total += cost
+        start -= 1
+    return messages[start:]
+
+def sse_deltas(lines: Iterable[bytes]) -> Iterator[str]:
+    """
+    Text deltas from server-sent chat completion events: "data: {...}" lines,
+    terminated by "data: [DONE]". Frames without text, or of an unexpected
+    shape, are skipped; a frame that is not JSON raises ValueError.
+    """
+    for line in lines:
+        if not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            break
+        
+        try:
+            content = orjson.loads(data)["choices"][0]["delta"]["content"]
+        except (LookupError, TypeError):
+            continue
+        if content and isinstance(content, str):
+            yield content
+
+# Streamed text is pushed to the UI at most every EMIT_INTERVAL seconds, or
+# sooner when a chunk ends at a word or line boundary
+EMIT_INTERVAL = 0.03
+EMIT_BOUNDARIES = ("\n", " ", ".", ",")
+
+# Optional semantic cache (SEMANTIC_CACHE=1, needs sentence-transformers):
+# a first-turn prompt close enough to one already answered by the same model
+# is served from memory instead of the API. Later turns depend on the
+# conversation, so they are never cached.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE") == "1"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_SIZE = 512
+
+_embedder = None
+_semantic_cache: Dict[str, Tuple] = {}  # routed model -> (unit vectors N×d, [(model used, response)])
+_semantic_lock = threading.Lock()
+
+def embed(message: str):
+    """Unit-length embedding of a message; loads the model on first use"""
+    global _embedder
+    if _embedder is None:
+        from sentence_transformers import SentenceTransformer
+        _embedder = SentenceTransformer("all-MiniLM-L6-v2")
+    return _embedder.encode(message, normalize_embeddings=True)
+
+def semantic_lookup(model_name: str, vector) -> Optional[Tuple[str, str]]:
+    """Cached (model used, response) for the most similar prompt, if it is similar enough"""
+    entry = _semantic_cache.get(model_name)
+    if entry is None:
+        return None
+    vectors, responses = entry
+    similarities = vectors @ vector
+    best = int(similarities.argmax())
+    if similarities[best] >= SEMANTIC_CACHE_THRESHOLD:
+        return responses[best]
+    return None
+
+def semantic_store(model_name: str, vector, model_used: str, response: str):
+    """Remember a successful response, dropping the oldest beyond SEMANTIC_CACHE_SIZE"""
+    if not response or response.startswith(ERROR_PREFIXES):
+        return
+    import numpy as np
+    with _semantic_lock:
+        entry = _semantic_cache.get(model_name)
+        if entry is None:
+            vectors, responses = np.empty((0, vector.shape[0]), dtype=vector.dtype), []
+        else:
+            vectors, responses = entry
+        vectors = np.vstack([vectors[-(SEMANTIC_CACHE_SIZE - 1):], vector])
+        responses = responses[-(SEMANTIC_CACHE_SIZE - 1):] + [(model_used, response)]
+        _semantic_cache[model_name] = (vectors, responses)